@@ -1,7 +1,7 @@
-import math
 from datetime import datetime
 import halide as hl
-from utils import time_diff, Point, gaussian_down4, box_down2, prev_tile, idx_layer, TILE_SIZE_2, DOWNSAMPLE_RATE
+from utils import time_diff, Point, gaussian_down4, box_down2, prev_tile, idx_layer, TILE_SIZE_2, DOWNSAMPLE_RATE, \
+    use_autoscheduler
 
 '''
 Determines the best offset for tiles of the image at a given resolution, 
@@ -46,9 +46,10 @@ def align_layer(layer, prev_alignment, prev_min, prev_max):
     # Alignment for each tile, where L1 distances are minimum
     alignment[tx, ty, n] = Point(hl.argmin(scores[rdom1.x, rdom1.y, tx, ty, n])) + prev_offset
 
-    scores.compute_at(alignment, tx).vectorize(xi, 8)
+    if not use_autoscheduler():
+        scores.compute_at(alignment, tx).vectorize(xi, 8)
 
-    alignment.compute_root().parallel(ty).vectorize(tx, 16)
+        alignment.compute_root().parallel(ty).vectorize(tx, 16)
 
     return alignment
 
@@ -58,7 +59,7 @@ Step 1 of HDR+ pipeline: align
 Creates a gaussian pyramid of downsampled images converted to grayscale.
 Uses first frame as reference. 
 
-images : Halide buffer
+images : Halide image parameter
     The raw burst frames
 
 Returns: Halide function representing an alignment of the burst frames
@@ -100,8 +101,8 @@ def align_images(images):
     alignment_1 = align_layer(layer_1, alignment_2, min_2, max_2)
     alignment_0 = align_layer(layer_0, alignment_1, min_1, max_1)
 
-    num_tx = math.floor(images.width() / TILE_SIZE_2 - 1) # number of tiles
-    num_ty = math.floor(images.height() / TILE_SIZE_2 - 1)
+    num_tx = images.width() / TILE_SIZE_2 - 1 # number of tiles
+    num_ty = images.height() / TILE_SIZE_2 - 1
 
     alignment[tx, ty, n] = 2 * Point(alignment_0[tx, ty, n]) # alignment of the original image
 
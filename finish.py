@@ -1,6 +1,6 @@
 import math
 import halide as hl
-from utils import DENOISE_PASSES, TONE_MAP_PASSES, SHARPEN_STRENGTH
+from utils import DENOISE_PASSES, TONE_MAP_PASSES, SHARPEN_STRENGTH, use_autoscheduler
 
 
 def black_white_level(input, black_point, white_point):
@@ -8,17 +8,17 @@ def black_white_level(input, black_point, white_point):
 
     x, y = hl.Var("x"), hl.Var("y")
 
-    white_factor = 65535 / (white_point - black_point)
+    white_factor = 65535 / hl.f32(white_point - black_point)
 
     output[x, y] = hl.u16_sat((hl.i32(input[x, y]) - black_point) * white_factor)
 
     return output
 
 
-def white_balance(input, width, height, white_balance_r, white_balance_g0, white_balance_g1, white_balance_b):
+def white_balance(input, width, height, white_balance_r, white_balance_b):
     output = hl.Func("white_balance_output")
 
-    print(width, height, white_balance_r, white_balance_g0, white_balance_g1, white_balance_b)
+    print(width, height, white_balance_r, white_balance_b)
 
     x, y = hl.Var("x"), hl.Var("y")
 
@@ -27,16 +27,18 @@ def white_balance(input, width, height, white_balance_r, white_balance_g0, white
     output[x, y] = hl.u16(0)
 
     output[rdom.x * 2, rdom.y * 2] = hl.u16_sat(white_balance_r * hl.f32(input[rdom.x * 2, rdom.y * 2]))
-    output[rdom.x * 2 + 1, rdom.y * 2] = hl.u16_sat(white_balance_g0 * hl.f32(input[rdom.x * 2 + 1, rdom.y * 2]))
-    output[rdom.x * 2, rdom.y * 2 + 1] = hl.u16_sat(white_balance_g1 * hl.f32(input[rdom.x * 2, rdom.y * 2 + 1]))
+    # White balance is relative to green, so the green values are unchanged
+    output[rdom.x * 2 + 1, rdom.y * 2] = input[rdom.x * 2 + 1, rdom.y * 2]
+    output[rdom.x * 2, rdom.y * 2 + 1] = input[rdom.x * 2, rdom.y * 2 + 1]
     output[rdom.x * 2 + 1, rdom.y * 2 + 1] = hl.u16_sat(white_balance_b * hl.f32(input[rdom.x * 2 + 1, rdom.y * 2 + 1]))
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
-    output.update(0).parallel(rdom.y)
-    output.update(1).parallel(rdom.y)
-    output.update(2).parallel(rdom.y)
-    output.update(3).parallel(rdom.y)
+        output.update(0).parallel(rdom.y)
+        output.update(1).parallel(rdom.y)
+        output.update(2).parallel(rdom.y)
+        output.update(3).parallel(rdom.y)
 
     return output
 
@@ -144,12 +146,13 @@ def demosaic(input, width, height):
                                 at_B & R_row & R_col, d3[x, y],
                                 input[x, y])
 
-    d0.compute_root().parallel(y).vectorize(x, 16)
-    d1.compute_root().parallel(y).vectorize(x, 16)
-    d2.compute_root().parallel(y).vectorize(x, 16)
-    d3.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        d0.compute_root().parallel(y).vectorize(x, 16)
+        d1.compute_root().parallel(y).vectorize(x, 16)
+        d2.compute_root().parallel(y).vectorize(x, 16)
+        d3.compute_root().parallel(y).vectorize(x, 16)
 
-    output.compute_root().parallel(y).align_bounds(x, 2).unroll(x, 2).align_bounds(y, 2).unroll(y, 2).vectorize(x, 16)
+        output.compute_root().parallel(y).align_bounds(x, 2).unroll(x, 2).align_bounds(y, 2).unroll(y, 2).vectorize(x, 16)
 
     return output
 
@@ -171,11 +174,12 @@ def rgb_to_yuv(input):
     output[x, y, 1] = -0.168935 * rdom - 0.331655 * g + 0.50059 * b
     output[x, y, 2] = 0.499813 * rdom - 0.418531 * g + - 0.081282 * b
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
-    output.update(0).parallel(y).vectorize(x, 16)
-    output.update(1).parallel(y).vectorize(x, 16)
-    output.update(2).parallel(y).vectorize(x, 16)
+        output.update(0).parallel(y).vectorize(x, 16)
+        output.update(1).parallel(y).vectorize(x, 16)
+        output.update(2).parallel(y).vectorize(x, 16)
 
     return output
 
@@ -268,12 +272,13 @@ def bilateral_filter(input, width, height):
     output[x, y, 1] = bilateral[x, y, 1]
     output[x, y, 2] = bilateral[x, y, 2]
 
-    weights.compute_at(output, y).vectorize(x, 16)
+    if not use_autoscheduler():
+        weights.compute_at(output, y).vectorize(x, 16)
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+        output.compute_root().parallel(y).vectorize(x, 16)
 
-    output.update(0).parallel(y).vectorize(x, 16)
-    output.update(1).parallel(y).vectorize(x, 16)
+        output.update(0).parallel(y).vectorize(x, 16)
+        output.update(1).parallel(y).vectorize(x, 16)
 
     return output
 
@@ -331,7 +336,8 @@ def desaturate_noise(input, width, height):
                                 (hl.abs(input[x, y, 2]) < threshold) & (hl.abs(blur[x, y, 2]) < threshold),
                                 0.7 * blur[x, y, 2] + 0.3 * input[x, y, 2], input[x, y, 2])
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
@@ -346,12 +352,13 @@ def increase_saturation(input, strength):
     output[x, y, c] = strength * input[x, y, c]
     output[x, y, 0] = input[x, y, 0]
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
 
-def yuv_to_rgb(input):
+def yuv_to_rgb(input, compute_root=True):
     print('    yuv_to_rgb')
 
     output = hl.Func("yuv_to_rgb_output")
@@ -362,17 +369,13 @@ def yuv_to_rgb(input):
     U = input[x, y, 1]
     V = input[x, y, 2]
 
-    output[x, y, c] = hl.cast(hl.UInt(16), 0)
+    # Single pure definition, so the conversion can be inlined into a pointwise consumer
+    output[x, y, c] = hl.select(c == 0, hl.u16_sat(Y + 1.403 * V),
+                                c == 1, hl.u16_sat(Y - 0.344 * U - 0.714 * V),
+                                hl.u16_sat(Y + 1.77 * U))
 
-    output[x, y, 0] = hl.u16_sat(Y + 1.403 * V)
-    output[x, y, 1] = hl.u16_sat(Y - 0.344 * U - 0.714 * V)
-    output[x, y, 2] = hl.u16_sat(Y + 1.77 * U)
-
-    output.compute_root().parallel(y).vectorize(x, 16)
-
-    output.update(0).parallel(y).vectorize(x, 16)
-    output.update(1).parallel(y).vectorize(x, 16)
-    output.update(2).parallel(y).vectorize(x, 16)
+    if compute_root and not use_autoscheduler():
+        output.compute_root().reorder(c, x, y).bound(c, 0, 3).unroll(c).parallel(y).vectorize(x, 16)
 
     return output
 
@@ -408,15 +411,16 @@ def srgb(input, ccm):
 
     srgb_matrix[x, y] = hl.f32(0)
 
-    srgb_matrix[0, 0] = hl.f32(ccm[0][0])
-    srgb_matrix[1, 0] = hl.f32(ccm[0][1])
-    srgb_matrix[2, 0] = hl.f32(ccm[0][2])
-    srgb_matrix[0, 1] = hl.f32(ccm[1][0])
-    srgb_matrix[1, 1] = hl.f32(ccm[1][1])
-    srgb_matrix[2, 1] = hl.f32(ccm[1][2])
-    srgb_matrix[0, 2] = hl.f32(ccm[2][0])
-    srgb_matrix[1, 2] = hl.f32(ccm[2][1])
-    srgb_matrix[2, 2] = hl.f32(ccm[2][2])
+    # ccm is indexed [column, row]
+    srgb_matrix[0, 0] = hl.f32(ccm[0, 0])
+    srgb_matrix[1, 0] = hl.f32(ccm[1, 0])
+    srgb_matrix[2, 0] = hl.f32(ccm[2, 0])
+    srgb_matrix[0, 1] = hl.f32(ccm[0, 1])
+    srgb_matrix[1, 1] = hl.f32(ccm[1, 1])
+    srgb_matrix[2, 1] = hl.f32(ccm[2, 1])
+    srgb_matrix[0, 2] = hl.f32(ccm[0, 2])
+    srgb_matrix[1, 2] = hl.f32(ccm[1, 2])
+    srgb_matrix[2, 2] = hl.f32(ccm[2, 2])
 
     output[x, y, c] = hl.u16_sat(hl.sum(srgb_matrix[rdom, c] * input[x, y, rdom]))
 
@@ -439,19 +443,20 @@ def gauss(input, k, rdom, name):
         val = hl.sum(blur_x[x, y + rdom] * k[rdom])
         # if input.output_types()[0] == hl.UInt(16):
         if input.type() == hl.UInt(16):
-            val = hl.u16(val)
+            val = hl.u16_sat(val)
         output[x, y] = val
     else:
         blur_x[x, y, c] = hl.sum(input[x + rdom, y, c] * k[rdom])
         val = hl.sum(blur_x[x, y + rdom, c] * k[rdom])
         # if input.output_types()[0] == hl.UInt(16):
         if input.type() == hl.UInt(16):
-            val = hl.u16(val)
+            val = hl.u16_sat(val)
         output[x, y, c] = val
 
-    blur_x.compute_at(output, x).vectorize(x, 16)
+    if not use_autoscheduler():
+        blur_x.compute_at(output, x).vectorize(x, 16)
 
-    output.compute_root().tile(x, y, xi, yi, 256, 128).vectorize(xi, 16).parallel(y)
+        output.compute_root().tile(x, y, xi, yi, 256, 128).vectorize(xi, 16).parallel(y)
 
     return output
 
@@ -542,12 +547,13 @@ def combine(im1, im2, width, height, dist):
 
     output[x, y] = hl.u16_sat(accumulator[x, y])
 
-    init_mask1.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        init_mask1.compute_root().parallel(y).vectorize(x, 16)
 
-    accumulator.compute_root().parallel(y).vectorize(x, 16)
+        accumulator.compute_root().parallel(y).vectorize(x, 16)
 
-    for i in range(num_layers):
-        accumulator.update(i).parallel(y).vectorize(x, 16)
+        for i in range(num_layers):
+            accumulator.update(i).parallel(y).vectorize(x, 16)
 
     return output
 
@@ -578,11 +584,12 @@ def combine2(im1, im2, width, height, dist):
 
     output[x, y] = hl.u16_sat(accumulator[x, y])
 
-    init_mask1.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        init_mask1.compute_root().parallel(y).vectorize(x, 16)
 
-    accumulator.compute_root().parallel(y).vectorize(x, 16)
+        accumulator.compute_root().parallel(y).vectorize(x, 16)
 
-    accumulator.update(0).parallel(y).vectorize(x, 16)
+        accumulator.update(0).parallel(y).vectorize(x, 16)
 
     return output
 
@@ -609,15 +616,16 @@ def gamma_correct(input):
     gamma_con = -3604.425
 
     if input.dimensions() == 2:
-        output[x, y] = hl.u16(hl.select(input[x, y] < cutoff,
-                                        gamma_toe * input[x, y],
-                                        gamma_fac * hl.pow(input[x, y], gamma_pow) + gamma_con))
+        output[x, y] = hl.u16_sat(hl.select(input[x, y] < cutoff,
+                                            gamma_toe * input[x, y],
+                                            gamma_fac * hl.pow(input[x, y], gamma_pow) + gamma_con))
     else:
-        output[x, y, c] = hl.u16(hl.select(input[x, y, c] < cutoff,
-                                           gamma_toe * input[x, y, c],
-                                           gamma_fac * hl.pow(input[x, y, c], gamma_pow) + gamma_con))
+        output[x, y, c] = hl.u16_sat(hl.select(input[x, y, c] < cutoff,
+                                               gamma_toe * input[x, y, c],
+                                               gamma_fac * hl.pow(input[x, y, c], gamma_pow) + gamma_con))
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
@@ -634,15 +642,16 @@ def gamma_inverse(input):
     gamma_con = 0.055
 
     if input.dimensions() == 2:
-        output[x, y] = hl.u16(hl.select(input[x, y] < cutoff,
-                                        gamma_toe * input[x, y],
-                                        hl.pow(hl.f32(input[x, y]) / 65535 + gamma_con, gamma_pow) * gamma_fac))
+        output[x, y] = hl.u16_sat(hl.select(input[x, y] < cutoff,
+                                            gamma_toe * input[x, y],
+                                            hl.pow(hl.f32(input[x, y]) / 65535 + gamma_con, gamma_pow) * gamma_fac))
     else:
-        output[x, y, c] = hl.u16(hl.select(input[x, y, c] < cutoff,
-                                           gamma_toe * input[x, y, c],
-                                           hl.pow(hl.f32(input[x, y, c]) / 65535 + gamma_con, gamma_pow) * gamma_fac))
+        output[x, y, c] = hl.u16_sat(hl.select(input[x, y, c] < cutoff,
+                                               gamma_toe * input[x, y, c],
+                                               hl.pow(hl.f32(input[x, y, c]) / 65535 + gamma_con, gamma_pow) * gamma_fac))
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
@@ -687,9 +696,10 @@ def tone_map(input, width, height, compression, gain):
 
     output[x, y, c] = hl.u16_sat(hl.u32(input[x, y, c]) * hl.u32(dark[x, y]) / hl.u32(hl.max(1, grayscale[x, y])))
 
-    grayscale.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        grayscale.compute_root().parallel(y).vectorize(x, 16)
 
-    normal_dist.compute_root().vectorize(v, 16)
+        normal_dist.compute_root().vectorize(v, 16)
 
     return output
 
@@ -716,21 +726,22 @@ def contrast(input, strength, black_point):
 
     scale = strength
 
-    inner_constant = math.pi / (2 * scale)
+    inner_constant = hl.f32(math.pi) / (2 * scale)
     sin_constant = hl.sin(inner_constant)
     slope = 65535 / (2 * sin_constant)
     constant = slope * sin_constant
-    factor = math.pi / (scale * 65535)
+    factor = hl.f32(math.pi) / (scale * 65535)
 
     val = factor * hl.cast(hl.Float(32), input[x, y, c])
 
     output[x, y, c] = hl.u16_sat(slope * hl.sin(val - inner_constant) + constant)
 
-    white_scale = 65535 / (65535 - black_point)
+    white_scale = 65535 / hl.f32(65535 - black_point)
 
     output[x, y, c] = hl.u16_sat((hl.cast(hl.Int(32), output[x, y, c]) - black_point) * white_scale)
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
@@ -747,12 +758,12 @@ def sharpen(input, strength):
 
     difference_of_gauss = diff(small_blurred, large_blurred, "unsharp_DoG")
 
-    output_yuv[x, y, c] = yuv_input[x, y, c]
-    output_yuv[x, y, 0] = yuv_input[x, y, 0] + strength * difference_of_gauss[x, y, 0]
+    output_yuv[x, y, c] = hl.select(c == 0, yuv_input[x, y, 0] + strength * difference_of_gauss[x, y, 0],
+                                    yuv_input[x, y, c])
 
-    output = yuv_to_rgb(output_yuv)
-
-    output_yuv.compute_root().parallel(y).vectorize(x, 16)
+    # The sharpened image is only consumed pointwise by the 8-bit interleave,
+    # so it is inlined into the pipeline output instead of being stored at full resolution
+    output = yuv_to_rgb(output_yuv, compute_root=False)
 
     return output
 
@@ -764,8 +775,6 @@ def u8bit_interleave(input):
 
     output[x, y, c] = hl.u8_sat(input[x, y, c] / 256)
 
-    output.compute_root().parallel(y).vectorize(x, 16)
-
     return output
 
 
@@ -784,18 +793,18 @@ Finishes the merged burst images using the following steps:
 10 : Sharpening
 11 : 8-bit interleaving
 
-image : Halide buffer
+image : Halide function
     The merged image to be finished
-width : Integer
+width : Halide expression
     Width of the image
-height : Integer
+height : Halide expression
     Height of the image
 black_point : Integer
     Black level of the image to be used for black and white level correction
 white_point : Integer
     White level of the image to be used for black and white level correction
 white_balance_x : Float
-    White balance value for color X (R, G, G, B)
+    White balance value for color X (R, B), relative to green
 compression : Float
     Compression value to be used for tone mapping
 gain : Float
@@ -804,15 +813,14 @@ contrast_strength : Float
     Contrast value to be used for contrast adjustment
 cfa_pattern : Integer
     Represents the Bayer pattern of the image, used to shift Bayer to RGGB
-ccm : numpy.ndarray of shape (3, 4)
+ccm : Halide buffer of shape (4, 3)
     Color correction matrix, used for sRGB color correction
 
-Returns: Halide buffer (finished image)
+Returns: Halide function (finished image)
 '''
-def finish_image(image, width, height, black_point, white_point, white_balance_r, white_balance_g0, white_balance_g1,
-                 white_balance_b, compression, gain, contrast_strength, cfa_pattern, ccm):
-    print(black_point, white_point, white_balance_r, white_balance_g0, white_balance_g1,
-          white_balance_b, compression, gain)
+def finish_image(image, width, height, black_point, white_point, white_balance_r, white_balance_b, compression, gain,
+                 contrast_strength, cfa_pattern, ccm):
+    print(black_point, white_point, white_balance_r, white_balance_b, compression, gain)
 
     print("bayer_to_rggb")
     bayer_shifted = shift_bayer_to_rggb(image, cfa_pattern)
@@ -821,8 +829,7 @@ def finish_image(image, width, height, black_point, white_point, white_balance_r
     black_white_level_output = black_white_level(bayer_shifted, black_point, white_point)
 
     print("white_balance")
-    white_balance_output = white_balance(black_white_level_output, width, height, white_balance_r, white_balance_g0,
-                                         white_balance_g1, white_balance_b)
+    white_balance_output = white_balance(black_white_level_output, width, height, white_balance_r, white_balance_b)
 
     print("demosaic")
     demosaic_output = demosaic(white_balance_output, width, height)
@@ -1,44 +1,79 @@
 import numpy as np
 import rawpy
-import imageio
-import os, sys, glob
+import os, sys, glob, re, atexit
 import os.path as opath
-import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 import halide as hl
 from datetime import datetime
 import threading
 from functools import partial
-os.environ['KIVY_NO_CONSOLELOG'] = '1' # Comment this line when debugging UI
-from kivy.app import App
-from kivy.uix.floatlayout import FloatLayout
-from kivy.factory import Factory
-from kivy.properties import ObjectProperty, StringProperty
-from kivy.uix.popup import Popup
-from kivy.uix.label import Label
-from kivy.uix.button import Button
-from kivy.uix.progressbar import ProgressBar
-from kivy.clock import Clock
 from utils import time_diff
-from align import align_images
-from merge import merge_images
-from finish import finish_image
 
-from PIL import Image
-import tiffile
+# libjpeg-turbo encoder for the output, created on first use.
+# False if PyTurboJPEG or the turbojpeg library is not installed
+_jpeg = None
+
+JPEG_QUALITY = 92
+
+# Colors of the raw_pattern channel indices, and the CFA patterns they decode to
+_CHANNELS = np.array(['R', 'G', 'B', 'G'])
+_PATTERNS = {'RGGB': 1, 'GRBG': 2, 'BGGR': 3, 'RGBG': 4}
+
+# Frame number of a burst image, e.g. payload_N003.dng
+_FRAME_NUMBER = re.compile(r'load_N(\d+)\.dng$', re.IGNORECASE)
+
+# Thread writing the reference image while the pipeline runs
+_writer = ThreadPoolExecutor(max_workers=1)
+
+# Worker processes decoding the burst frames, created on first use and reused for every burst.
+# One core is left free for the UI thread
+_LOADER_WORKERS = max(1, min((os.cpu_count() or 2) - 1, 16))
+_loader = None
 
 
 '''
-Loads a raw image
+Loads a raw image into a slice of a shared memory burst
 
 image_path : str
     String representing the path to the image
-
-Returns: numpy ndarray with 4 values for each pixel (RGGB)
+shm_name : str
+    Name of the shared memory block holding the burst
+index : int
+    Index of the image in the burst
+height : int
+    Height of the visible raw image
+width : int
+    Width of the visible raw image
+is_ref : bool
+    Whether the image is the reference frame of the burst, in which case its metadata
+    and postprocessed version are read from the same decode
+
+Returns: None, the raw image (4 values for each pixel, RGGB) is written to the shared burst
+         If is_ref is set, a dictionary of the image metadata and the postprocessed reference image
 '''
-def load_image(image_path):
-    with rawpy.imread(image_path) as raw:
-        image = raw.raw_image_visible.copy()
-        return image
+def load_image(image_path, shm_name, index, height, width, is_ref=False):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    image = np.ndarray((height, width), dtype=np.uint16, buffer=shm.buf, offset=index * height * width * 2)
+    try:
+        with rawpy.imread(image_path) as raw:
+            np.copyto(image, raw.raw_image_visible)
+            if not is_ref:
+                return None
+            metadata = {
+                'white_balance': raw.camera_whitebalance,
+                'cfa_pattern': raw.raw_pattern.copy(),
+                'ccm': raw.color_matrix.copy(),
+                'black_point': int(raw.black_level_per_channel[0]),
+                'white_point': int(raw.white_level),
+            }
+            ref_img = raw.postprocess(output_bps=16)
+            return metadata, ref_img
+    finally:
+        del image
+        shm.close()
 
 
 '''
@@ -54,25 +89,71 @@ Returns: Integer in range 1 - 4, where
     4 : RGBG
 '''
 def decode_pattern(pattern):
-    pattern_str = ""
-    for row in pattern:
-        for val in row:
-            if val == 0:
-                pattern_str += 'R'
-            elif val == 1:
-                pattern_str += 'G'
-            elif val == 2:
-                pattern_str += 'B'
-            else:
-                pattern_str += 'G'
-    if pattern_str == 'RGGB':
-        return 1
-    elif pattern_str == 'GRBG':
-        return 2
-    elif pattern_str == 'BGGR':
-        return 3
-    else:
-        return 4
+    return _PATTERNS.get(''.join(_CHANNELS[np.asarray(pattern).ravel()]), 4)
+
+
+'''
+Sort key of a burst image: its frame number, then its path.
+Images without a frame number are sorted first, by path.
+
+image_path : str
+    String representing the path to the image
+
+Returns: tuple (int, str)
+'''
+def frame_key(image_path):
+    match = _FRAME_NUMBER.search(image_path)
+    return (int(match.group(1)) if match else -1), image_path
+
+
+'''
+Saves an image as JPEG, with libjpeg-turbo if available, otherwise with PIL
+
+path : str
+    Path of the JPEG file
+image : numpy.ndarray
+    C-contiguous (H, W, 3) uint8 RGB image
+
+Returns: None
+'''
+def save_jpeg(path, image):
+    global _jpeg
+    if _jpeg is None:
+        try:
+            from turbojpeg import TurboJPEG
+            _jpeg = TurboJPEG()
+        except (ImportError, OSError, RuntimeError):
+            _jpeg = False
+    if not _jpeg:
+        from PIL import Image
+        Image.fromarray(image).save(path, quality=JPEG_QUALITY)
+        return
+    from turbojpeg import TJPF_RGB
+    with open(path, 'wb') as f:
+        f.write(_jpeg.encode(image, quality=JPEG_QUALITY, pixel_format=TJPF_RGB))
+
+
+'''
+Get the pool of worker processes decoding the burst frames, starting it on first use
+
+Returns: concurrent.futures.ProcessPoolExecutor
+'''
+def _get_loader():
+    global _loader
+    if _loader is None:
+        _loader = ProcessPoolExecutor(max_workers=_LOADER_WORKERS)
+        atexit.register(_loader.shutdown)
+    return _loader
+
+
+'''
+Drops the pool of worker processes after one of them died, so that the next burst starts a new pool
+'''
+def _reset_loader():
+    global _loader
+    if _loader is not None:
+        _loader.shutdown(wait=False)
+        _loader = None
 
 
 '''
@@ -81,16 +162,14 @@ Loads a burst of images
 burst_path : str
     String representing the path to the folder containing the burst images
 
-Returns: Halide buffer of raw images, reference image, white balance values for RGGB, 
-         black level, white level, CFA pattern, color correction matrix
+Returns: Halide buffer of raw images, shared memory backing the buffer, reference image, white balance values
+         for R and B (relative to G), black level, white level, CFA pattern, color correction matrix.
+         The caller owns the shared memory and must close it once the buffer is not used anymore.
 '''
 def load_images(burst_path):
     print(f'\n{"=" * 30}\nLoading images...\n{"=" * 30}')
     start = datetime.utcnow()
-    images = []
     white_balance_r = 0
-    white_balance_g0 = 0
-    white_balance_g1 = 0
     white_balance_b = 0
     black_point = 0
     white_point = 0
@@ -101,41 +180,55 @@ def load_images(burst_path):
     paths = glob.glob(opath.join(burst_path, '*.dng'))
     if len(paths) == 0:
         raise ValueError("Burst format [*.dng] not recognized.")
-    paths.sort(key=lambda x: int(x.split('load_N')[-1].split('.')[0]))
+    paths.sort(key=frame_key)
 
-    # Load raw images
-    print('Loading raw images...')
-    p = multiprocessing.Pool(min(multiprocessing.cpu_count() - 1, len(paths)))
-    for image in p.imap(load_image, paths):
-        images.append(hl.Buffer(image))
+    assert len(paths) >= 2, "Burst must consist of at least 2 images"
 
-    assert len(images) >= 2, "Burst must consist of at least 2 images"
-
-    # Get a reference image to compare results
-    print('Getting reference image...')
+    # Only the header of the reference frame is needed for the burst dimensions,
+    # imread opens the file without unpacking the raw data
     with rawpy.imread(paths[0]) as raw:
-        white_balance = raw.camera_whitebalance
-        print('white balance', white_balance)
-        white_balance_r = white_balance[0] / white_balance[1]
-        white_balance_g0 = 1
-        white_balance_g1 = 1
-        white_balance_b = white_balance[2] / white_balance[1]
-        cfa_pattern = raw.raw_pattern
-        cfa_pattern = decode_pattern(cfa_pattern)
-        ccm = raw.color_matrix
-        black_point = int(raw.black_level_per_channel[0])
-        white_point = int(raw.white_level)
-
-        ref_img = raw.postprocess(output_bps=16)
+        height, width = raw.sizes.height, raw.sizes.width
 
+    # Load raw images
+    # Each worker decodes its frame directly into a slice of one shared memory block.
+    # The reference frame is decoded once, together with its metadata and postprocessed version,
+    # in parallel with the alternate frames
+    print('Loading raw images...')
+    shm = shared_memory.SharedMemory(create=True, size=len(paths) * height * width * 2)
+    try:
+        loader = _get_loader()
+        ref_result = loader.submit(load_image, paths[0], shm.name, 0, height, width, True)
+        # Alternate frames are handed out in chunks, one per worker, and any worker error is raised here
+        list(loader.map(load_image, paths[1:], repeat(shm.name), range(1, len(paths)), repeat(height),
+                        repeat(width), chunksize=max(1, (len(paths) - 1) // _LOADER_WORKERS)))
+        metadata, ref_img = ref_result.result()
+    except BaseException as e:
+        shm.close()
+        if isinstance(e, BrokenProcessPool):
+            _reset_loader()
+        raise
+    finally:
+        shm.unlink()
+
+    # The (N, H, W) burst is already packed in the (x, y, n) layout Halide expects,
+    # so the buffer is a view of the shared memory instead of a copy.
+    # The buffer does not keep the shared memory mapped, it is returned so that the caller can close it
     print('Building image buffer...')
-    result = hl.Buffer(hl.UInt(16), [images[0].width(), images[0].height(), len(images)])
-    for index, image in enumerate(images):
-        resultSlice = result.sliced(2, index)
-        resultSlice.copy_from(image)
+    result = hl.Buffer(np.ndarray((len(paths), height, width), dtype=np.uint16, buffer=shm.buf))
+
+    # Get the reference image metadata
+    print('Getting reference image...')
+    white_balance = metadata['white_balance']
+    print('white balance', white_balance)
+    white_balance_r = white_balance[0] / white_balance[1]
+    white_balance_b = white_balance[2] / white_balance[1]
+    cfa_pattern = decode_pattern(metadata['cfa_pattern'])
+    ccm = metadata['ccm']
+    black_point = metadata['black_point']
+    white_point = metadata['white_point']
 
     print(f'Loading finished in {time_diff(start)} ms.\n')
-    return result, ref_img, white_balance_r, white_balance_g0, white_balance_g1, white_balance_b, black_point, white_point, cfa_pattern, ccm
+    return result, shm, ref_img, white_balance_r, white_balance_b, black_point, white_point, cfa_pattern, ccm
 
 
 '''
@@ -150,7 +243,7 @@ gain : float
 contrast : float
     Contrast to be used in finish step
 UI : Root(FloatLayout) class object
-    Kivy object used to update UI elements
+    Kivy object used to update UI elements: UI.progress is set as the pipeline advances
 
 After execution finishes, UI.original and UI.image will be set to the reference frame of the input,
 and the result of the burst processed by the HDR+ pipeline, respectively.
@@ -158,63 +251,76 @@ and the result of the burst processed by the HDR+ pipeline, respectively.
 If an error is encountered, these values will instead remain unchanged, and an error will be passed to the UI.
 '''
 def HDR(burst_path, compression, gain, contrast, UI):
+    from kivy.clock import Clock
+
     try:
+        # Imported here, so that a missing module is reported to the UI like any other error
+        import tiffile
+        from pipeline import get_pipeline
+
         start = datetime.utcnow()
 
         print(f'Compression: {compression}, gain: {gain}, contrast: {contrast}')
 
         # Load the images
         print('Loading images... from ', burst_path)
-        images, ref_img, white_balance_r, white_balance_g0, white_balance_g1, white_balance_b, black_point, white_point, cfa_pattern, ccm = load_images(
-            burst_path)
-        Clock.schedule_once(partial(UI.update_progress, 20))
-
-        # dimensions of image should be 3
-        assert images.dimensions() == 3, f"Incorrect buffer dimensions, expected 3 but got {images.dimensions()}"
-        assert images.dim(2).extent() >= 2, f"Must have at least one alternate image"
-        # Save the reference image
-        print('Saving reference image...')
-        # imageio.imsave('Output/input.jpg', ref_img)
-        tiffile.imwrite("Output/input.tiff", ref_img)
-
-        # Align the images
-        alignment = align_images(images)
-
-        # Merge the images
-        merged = merge_images(images, alignment)
-
-        # Finish the image
-        print(f'\n{"=" * 30}\nFinishing image...\n{"=" * 30}')
-        start_finish = datetime.utcnow()
-        finished = finish_image(merged, images.width(), images.height(), black_point, white_point, white_balance_r,
-                                white_balance_g0, white_balance_g1, white_balance_b, compression, gain, contrast,
-                                cfa_pattern, ccm)
-
-        Clock.schedule_once(partial(UI.update_progress, 30))
-
-        result = finished.realize([images.width(), images.height(), 3])
-
-        Clock.schedule_once(partial(UI.update_progress, 90))
-
-        print(f'Finishing finished in {time_diff(start_finish)} ms.\n')
-
-        # If portrait orientation, rotate image 90 degrees clockwise
-        print('ref_img.shape: ', ref_img.shape)
-        np_array = np.array(result, copy=False)  # (3, H, W)
-        print('np_array.shape(result): ', np_array.shape)
-        np_array = np.transpose(np_array, (1, 2, 0))  # (H, W, 3)
-        if ref_img.shape[0] > ref_img.shape[1]:
-            print('Rotating image')
-            np_array = np.rot90(np_array, -1)
+        images, burst_shm, ref_img, white_balance_r, white_balance_b, black_point, white_point, cfa_pattern, ccm = \
+            load_images(burst_path)
+        UI.progress = 20
+
+        try:
+            # dimensions of image should be 3
+            assert images.dimensions() == 3, f"Incorrect buffer dimensions, expected 3 but got {images.dimensions()}"
+            assert images.dim(2).extent() >= 2, f"Must have at least one alternate image"
+            # Save the reference image
+            print('Saving reference image...')
+            # imageio.imsave('Output/input.jpg', ref_img)
+            # Written in the background, overlapping with the pipeline
+            saved_ref = _writer.submit(tiffile.imwrite, "Output/input.tiff", ref_img)
+
+            # Only the shape of the reference image is needed from now on, it is freed once it has been written
+            ref_shape = ref_img.shape
+            del ref_img
+
+            # Align, merge and finish the images
+            start_finish = datetime.utcnow()
+            hdr_plus = get_pipeline()
+
+            UI.progress = 30
+
+            # If portrait orientation, the pipeline rotates the image 90 degrees clockwise
+            print('ref_img.shape: ', ref_shape)
+            rotate = ref_shape[0] > ref_shape[1]
+            if rotate:
+                print('Rotating image')
+                np_array = np.empty((images.width(), images.height(), 3), dtype=np.uint8)
+            else:
+                np_array = np.empty((images.height(), images.width(), 3), dtype=np.uint8)
+            # Halide buffer of dimensions (W, H, 3) viewing the interleaved (H, W, 3) array
+            result = hl.Buffer(np_array.transpose(2, 0, 1))
+            hdr_plus(images, black_point, white_point, white_balance_r, white_balance_b, compression, gain, contrast,
+                     cfa_pattern, hl.Buffer(np.ascontiguousarray(ccm, dtype=np.float32)), rotate, result)
+        finally:
+            # The raw burst is not needed anymore, release its shared memory before encoding the output,
+            # also when the pipeline failed, so the traceback does not keep the burst mapped
+            del images
+            burst_shm.close()
+
+        UI.progress = 90
+
+        print(f'Pipeline finished in {time_diff(start_finish)} ms.\n')
+
         print('np_array.shape(final): ', np_array.shape)
-        Image.fromarray(np_array).save('Output/output.jpg')
+        save_jpeg('Output/output.jpg', np_array)
 
-        Clock.schedule_once(partial(UI.update_progress, 100))
+        UI.progress = 100
 
         print(f'Processed in: {time_diff(start)} ms')
 
         # return 'Output/input.jpg', 'Output/output.jpg'
 
+        saved_ref.result()
+
         Clock.schedule_once(partial(UI.update_paths, 'Output/input.tiff', 'Output/output.jpg'))
 
         Clock.schedule_once(UI.dismiss_progress)
@@ -223,141 +329,164 @@ def HDR(burst_path, compression, gain, contrast, UI):
         Clock.schedule_once(partial(UI.show_error, e))
 
 
-class Imglayout(FloatLayout):
-    def __init__(self, **args):
-        super(Imglayout, self).__init__(**args)
-
-        with self.canvas.before:
-            Color(0, 0, 0, 0)
-            self.rect = Rectangle(size=self.size, pos=self.pos)
-
-        self.bind(size=self.updates, pos=self.updates)
-
-    def updates(self, instance, value):
-        self.rect.size = instance.size
-        self.rect.pos = instance.pos
-
-
-class LoadDialog(FloatLayout):
-    load = ObjectProperty(None)
-    cancel = ObjectProperty(None)
-    path = StringProperty('')
-
-class Root(FloatLayout):
-    loadfile = ObjectProperty(None)
-    progress_bar = ObjectProperty()
-    progress_popup = None
-
-    # Empty gallery images
-    original = 'Images/gallery.jpg'
-    image = 'Images/gallery.jpg'
-
-    # Path to the burst images
-    path = ''
-
-    cancelled = False
-
-    compression = 3.8
-    gain = 1.1
-    contrast = 1.0
-
-    def build():
-        c = Imglayout()
-        root.add_widget(c)
-
-    def dismiss_popup(self):
-        self._popup.dismiss()
-
-    def dismiss_progress(self, *largs):
-        self.progress_popup.dismiss()
-
-    def update_progress(self, num, *largs):
-        self.progress_bar.value = num
-
-    def update_paths(self, input_path, output_path, *largs):
-        self.original = input_path
-        self.image = output_path
-
-    def reload_images(self, instance):
-        self.ids.image0.source = self.original
-        self.ids.image0.reload()
-        self.ids.image1.source = self.image
-        self.ids.image1.reload()
-
-    def next(self, dt):
-        if self.progress_bar.value >= 100:
-            return False
-        self.progress_bar.value += 1
-
-    def show_error(self, error, *largs):
-        if self.progress_popup:
-            self.dismiss_progress()
-        txt = '\n'.join(str(error)[i:i + 80] for i in range(0, len(str(error)), 80))
-        float_popup = FloatLayout(size_hint=(0.9, .04))
-        float_popup.add_widget(Label(text=txt,
-                                     size_hint=(0.7, 1),
-                                     pos_hint={'x': 0.15, 'y': 12}))
-        float_popup.add_widget(Button(text='Close',
-                                      on_press=lambda *args: popup.dismiss(),
-                                      size_hint=(0.2, 4),
-                                      pos_hint={'x': 0.4, 'y': 1}))
-        popup = Popup(title='Error',
-                      content=float_popup,
-                      size_hint=(0.9, 0.4))
-        popup.open()
-
-    # Function to call the HDR+ pipeline
-    def process(self):
-        try:
-            if not self.path:
-                raise ValueError('No burst selected.')
-            # Get slider values for compression, gain, and contrast
-            self.compression = self.ids.compression.value
-            self.gain = self.ids.gain.value
-            self.contrast = self.ids.contrast.value
-
-            self.progress_bar = ProgressBar()
-            self.progress_popup = Popup(title=f'Processing {self.path}',
-                                        content=self.progress_bar,
-                                        size_hint=(0.7, 0.2),
-                                        auto_dismiss=False)
-            self.progress_popup.bind(on_dismiss=self.reload_images)
-            self.progress_bar.value = 1
-            self.progress_popup.open()
-            Clock.schedule_interval(self.next, 0.1)
-
-            HDR_thread = threading.Thread(target=HDR,
-                                          args=(self.path, self.compression, self.gain, self.contrast, self,))
-            HDR_thread.start()
-
-        except Exception as e:
-            self.show_error(e)
-
-    def show_load(self):
-        content = LoadDialog(load=self.load, cancel=self.dismiss_popup)
-        content.path = r'E:\Dev\dataset\hdrplus'
-        self._popup = Popup(title="Select burst image", content=content,
-                            size_hint=(0.9, 0.9))
-
-        self._popup.open()
-
-    def load(self, path, filename):
-        # Set the path to the burst images
-        self.path = path
-        self.cancelled = False
-        self.dismiss_popup()
-
-    def cancel(self):
-        self.cancelled = True
-        self.dismiss_popup()
-
-
-class HDR_Plus(App):
-    pass
+'''
+Defines the Kivy user interface. Kivy is only imported here, so that importing this module,
+e.g. in the processes loading the burst, does not load Kivy
 
+Returns: the Kivy App class of the user interface
+'''
+def _init_ui():
+    os.environ['KIVY_NO_CONSOLELOG'] = '1' # Comment this line when debugging UI
+    from kivy.app import App
+    from kivy.uix.floatlayout import FloatLayout
+    from kivy.factory import Factory
+    from kivy.properties import ObjectProperty, StringProperty
+    from kivy.uix.popup import Popup
+    from kivy.uix.label import Label
+    from kivy.uix.button import Button
+    from kivy.uix.progressbar import ProgressBar
+    from kivy.clock import Clock
+
+    class Imglayout(FloatLayout):
+        def __init__(self, **args):
+            super(Imglayout, self).__init__(**args)
+
+            with self.canvas.before:
+                Color(0, 0, 0, 0)
+                self.rect = Rectangle(size=self.size, pos=self.pos)
+
+            self.bind(size=self.updates, pos=self.updates)
+
+        def updates(self, instance, value):
+            self.rect.size = instance.size
+            self.rect.pos = instance.pos
+
+
+    class LoadDialog(FloatLayout):
+        load = ObjectProperty(None)
+        cancel = ObjectProperty(None)
+        path = StringProperty('')
+
+    class Root(FloatLayout):
+        loadfile = ObjectProperty(None)
+        progress_bar = ObjectProperty()
+        progress_popup = None
+        progress_event = None
+
+        # Progress of the running pipeline in percent, set by the HDR thread
+        progress = 0
+
+        # Empty gallery images
+        original = 'Images/gallery.jpg'
+        image = 'Images/gallery.jpg'
+
+        # Path to the burst images
+        path = ''
+
+        cancelled = False
+
+        compression = 3.8
+        gain = 1.1
+        contrast = 1.0
+
+        def build():
+            c = Imglayout()
+            root.add_widget(c)
+
+        def dismiss_popup(self):
+            self._popup.dismiss()
+
+        def dismiss_progress(self, *largs):
+            self.progress_event.cancel()
+            self.progress_popup.dismiss()
+
+        # Show the progress set by the HDR thread, polled once per frame
+        def update_progress(self, dt):
+            self.progress_bar.value = self.progress
+
+        def update_paths(self, input_path, output_path, *largs):
+            self.original = input_path
+            self.image = output_path
+
+        def reload_images(self, instance):
+            self.ids.image0.source = self.original
+            self.ids.image0.reload()
+            self.ids.image1.source = self.image
+            self.ids.image1.reload()
+
+        def show_error(self, error, *largs):
+            if self.progress_popup:
+                self.dismiss_progress()
+            txt = '\n'.join(str(error)[i:i + 80] for i in range(0, len(str(error)), 80))
+            float_popup = FloatLayout(size_hint=(0.9, .04))
+            float_popup.add_widget(Label(text=txt,
+                                         size_hint=(0.7, 1),
+                                         pos_hint={'x': 0.15, 'y': 12}))
+            float_popup.add_widget(Button(text='Close',
+                                          on_press=lambda *args: popup.dismiss(),
+                                          size_hint=(0.2, 4),
+                                          pos_hint={'x': 0.4, 'y': 1}))
+            popup = Popup(title='Error',
+                          content=float_popup,
+                          size_hint=(0.9, 0.4))
+            popup.open()
+
+        # Function to call the HDR+ pipeline
+        def process(self):
+            try:
+                if not self.path:
+                    raise ValueError('No burst selected.')
+                # Get slider values for compression, gain, and contrast
+                self.compression = self.ids.compression.value
+                self.gain = self.ids.gain.value
+                self.contrast = self.ids.contrast.value
+
+                self.progress_bar = ProgressBar()
+                self.progress_popup = Popup(title=f'Processing {self.path}',
+                                            content=self.progress_bar,
+                                            size_hint=(0.7, 0.2),
+                                            auto_dismiss=False)
+                self.progress_popup.bind(on_dismiss=self.reload_images)
+                self.progress = 1
+                self.progress_bar.value = 1
+                self.progress_popup.open()
+                self.progress_event = Clock.schedule_interval(self.update_progress, 1 / 30)
+
+                HDR_thread = threading.Thread(target=HDR,
+                                              args=(self.path, self.compression, self.gain, self.contrast, self,))
+                HDR_thread.start()
+
+            except Exception as e:
+                self.show_error(e)
+
+        def show_load(self):
+            content = LoadDialog(load=self.load, cancel=self.dismiss_popup)
+            content.path = r'E:\Dev\dataset\hdrplus'
+            self._popup = Popup(title="Select burst image", content=content,
+                                size_hint=(0.9, 0.9))
+
+            self._popup.open()
+
+        def load(self, path, filename):
+            # Set the path to the burst images
+            self.path = path
+            self.cancelled = False
+            self.dismiss_popup()
+
+        def cancel(self):
+            self.cancelled = True
+            self.dismiss_popup()
+
+
+    class HDR_Plus(App):
+        pass
+
+
+    Factory.register('Root', cls=Root)
+    Factory.register('LoadDialog', cls=LoadDialog)
+
+    return HDR_Plus
 
-Factory.register('Root', cls=Root)
-Factory.register('LoadDialog', cls=LoadDialog)
 
 if __name__ == '__main__':
-    HDR_Plus().run()
+    _init_ui()().run()
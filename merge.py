@@ -1,7 +1,7 @@
 from datetime import datetime
 import halide as hl
 from utils import time_diff, Point, box_down2, idx_layer, idx_im, idx_0, idx_1, tile_0, tile_1, TILE_SIZE, \
-    MINIMUM_OFFSET, MAXIMUM_OFFSET
+    MINIMUM_OFFSET, MAXIMUM_OFFSET, use_autoscheduler
 import math
 
 '''
@@ -10,7 +10,7 @@ Weights different frames based on the similarity between the reference tile
 and the alternate tiles, minimizing L1 distances (least absolute deviation).
 Distances greater than some threshold (max_distance) are discarded.
 
-images : Halide buffer
+images : Halide image parameter
     Burst frames to be merged
 alignment : Halide function
     Calculated alignment of the burst frames
@@ -66,11 +66,12 @@ def merge_temporal(images, alignment):
     output[ix, iy, tx, ty] = hl.sum(weight[tx, ty, rdom1] * alt_val / total_weight[tx, ty]) + ref_val / total_weight[
         tx, ty]
 
-    weight.compute_root().parallel(ty).vectorize(tx, 16)
+    if not use_autoscheduler():
+        weight.compute_root().parallel(ty).vectorize(tx, 16)
 
-    total_weight.compute_root().parallel(ty).vectorize(tx, 16)
+        total_weight.compute_root().parallel(ty).vectorize(tx, 16)
 
-    output.compute_root().parallel(ty).vectorize(ix, 32)
+        output.compute_root().parallel(ty).vectorize(ix, 32)
 
     return output
 
@@ -103,14 +104,15 @@ def merge_spatial(input):
     val_01 = input[idx_0(x), idx_1(y), tile_0(x), tile_1(y)]
     val_11 = input[idx_1(x), idx_1(y), tile_1(x), tile_1(y)]
 
-    output[x, y] = hl.cast(hl.UInt(16), weight_00 * val_00
-                           + weight_10 * val_10
-                           + weight_01 * val_01
-                           + weight_11 * val_11)
+    output[x, y] = hl.u16_sat(weight_00 * val_00
+                              + weight_10 * val_10
+                              + weight_01 * val_01
+                              + weight_11 * val_11)
 
-    weight.compute_root().vectorize(v, 32)
+    if not use_autoscheduler():
+        weight.compute_root().vectorize(v, 32)
 
-    output.compute_root().parallel(y).vectorize(x, 32)
+        output.compute_root().parallel(y).vectorize(x, 32)
 
     return output
 
@@ -118,7 +120,7 @@ def merge_spatial(input):
 '''
 Step 2 of HDR+ pipeline: merge
 
-images : Halide buffer
+images : Halide image parameter
     Burst frames to be merged
 alignment : Halide function
     Calculated alignment of the burst frames
@@ -0,0 +1,133 @@
+import os, glob
+import os.path as opath
+import halide as hl
+from align import align_images
+from merge import merge_images
+from finish import finish_image
+from utils import use_autoscheduler
+
+# Halide autoscheduler used for the JIT pipeline instead of the manual schedules, one of AUTOSCHEDULERS.
+# Empty to use the manual schedules.
+AUTOSCHEDULER = os.environ.get('HDR_PLUS_AUTOSCHEDULER', '')
+
+# Autoschedulers that work with this pipeline. Adams2019 runs out of memory during its search,
+# and Anderson2021 only schedules GPU targets
+AUTOSCHEDULERS = ['Mullapudi2016']
+
+# Size of the 12 MP bursts most cameras take, used for the autoscheduler estimates
+BURST_WIDTH = 4032
+BURST_HEIGHT = 3024
+
+'''
+Halide Generator for the full HDR+ pipeline: align, merge, finish
+
+The pipeline only depends on the burst and the scalar inputs below, so it is compiled once and
+reused for every burst. It can also be compiled ahead of time with the Halide generator command line:
+    python pipeline.py -g hdr_plus -o <output_dir> target=host
+or, to schedule it with an autoscheduler instead of the manual schedules:
+    python pipeline.py -g hdr_plus -o <output_dir> -p <autoschedule_mullapudi2016 library> target=host autoscheduler=Mullapudi2016
+'''
+@hl.generator(name="hdr_plus")
+class HDRPlus:
+    images = hl.InputBuffer(hl.UInt(16), 3)
+    black_point = hl.InputScalar(hl.Int(32))
+    white_point = hl.InputScalar(hl.Int(32))
+    white_balance_r = hl.InputScalar(hl.Float(32))
+    white_balance_b = hl.InputScalar(hl.Float(32))
+    compression = hl.InputScalar(hl.Float(32))
+    gain = hl.InputScalar(hl.Float(32))
+    contrast = hl.InputScalar(hl.Float(32))
+    cfa_pattern = hl.InputScalar(hl.Int(32))
+    ccm = hl.InputBuffer(hl.Float(32), 2)
+    rotate = hl.InputScalar(hl.Bool())
+
+    output = hl.OutputBuffer(hl.UInt(8), 3)
+
+    def generate(g):
+        x, y, c = hl.Var("x"), hl.Var("y"), hl.Var("c")
+
+        alignment = align_images(g.images)
+
+        merged = merge_images(g.images, alignment)
+
+        print(f'\n{"=" * 30}\nFinishing image...\n{"=" * 30}')
+        finished = finish_image(merged, g.images.width(), g.images.height(), g.black_point, g.white_point,
+                                g.white_balance_r, g.white_balance_b, g.compression, g.gain, g.contrast,
+                                g.cfa_pattern, g.ccm)
+
+        # If portrait orientation, rotate image 90 degrees clockwise
+        g.output[x, y, c] = hl.select(g.rotate, finished[y, g.images.height() - 1 - x, c], finished[x, y, c])
+
+        # Interleaved (H, W, 3) output, so it can be handed to numpy and PIL without repacking
+        g.output.output_buffer().dim(0).set_stride(3).dim(2).set_stride(1).set_bounds(0, 3)
+
+        if use_autoscheduler():
+            # Estimates for a 12 MP burst of 8 frames
+            g.images.set_estimates([(0, BURST_WIDTH), (0, BURST_HEIGHT), (0, 8)])
+            g.black_point.set_estimate(64)
+            g.white_point.set_estimate(1023)
+            g.white_balance_r.set_estimate(2.0)
+            g.white_balance_b.set_estimate(1.5)
+            g.compression.set_estimate(3.8)
+            g.gain.set_estimate(1.1)
+            g.contrast.set_estimate(1.0)
+            g.cfa_pattern.set_estimate(1)
+            g.ccm.set_estimates([(0, 4), (0, 3)])
+            g.rotate.parameter().set_estimate(hl.Expr(False))  # Param.set_estimate(False) makes an int32 estimate
+            g.output.set_estimates([(0, BURST_WIDTH), (0, BURST_HEIGHT), (0, 3)])
+        else:
+            g.output.reorder(c, x, y).bound(c, 0, 3).unroll(c).parallel(y).vectorize(x, 16)
+
+            # Separate loops for each orientation, so only the needed region of the finished image is computed
+            g.output.specialize(g.rotate)
+
+
+# Names of the HDRPlus inputs, in the order the compiled pipeline takes them (keep in sync with the class)
+INPUTS = ['images', 'black_point', 'white_point', 'white_balance_r', 'white_balance_b', 'compression', 'gain',
+          'contrast', 'cfa_pattern', 'ccm', 'rotate']
+
+_pipeline = None
+
+'''
+Load a Halide autoscheduler plugin.
+The halide package ships the plugins next to libHalide, which is usually not on the library search path.
+
+name : str
+    Name of the autoscheduler, e.g. Mullapudi2016
+'''
+def load_autoscheduler(name):
+    lib = 'autoschedule_' + name.lower()
+    paths = glob.glob(opath.join(opath.dirname(hl.__file__), '**', '*' + lib + '.*'), recursive=True)
+    hl.load_plugin(paths[0] if paths else lib)
+
+
+'''
+Get the compiled HDR+ pipeline, compiling it for the JIT target on first use.
+If AUTOSCHEDULER is set, the pipeline is scheduled by that autoscheduler before compiling.
+Raises ValueError if AUTOSCHEDULER is not one of AUTOSCHEDULERS.
+
+Returns: Halide Callable taking the HDRPlus inputs followed by the output buffer
+'''
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        target = hl.get_jit_target_from_environment()
+        if not AUTOSCHEDULER:
+            with hl.GeneratorContext(target):
+                _pipeline = HDRPlus().compile_to_callable()
+        else:
+            if AUTOSCHEDULER not in AUTOSCHEDULERS:
+                raise ValueError(f"Unsupported autoscheduler {AUTOSCHEDULER}, "
+                                 f"HDR_PLUS_AUTOSCHEDULER must be one of {', '.join(AUTOSCHEDULERS)} or empty.")
+            load_autoscheduler(AUTOSCHEDULER)
+            autoscheduler = hl.AutoschedulerParams(AUTOSCHEDULER)
+            with hl.GeneratorContext(target, autoscheduler):
+                pipeline = hl.Pipeline(HDRPlus.call(*[None] * len(INPUTS)))
+                pipeline.apply_autoscheduler(target, autoscheduler)
+                arguments = {argument.name: argument for argument in pipeline.infer_arguments()}
+                _pipeline = pipeline.compile_to_callable([arguments[name] for name in INPUTS], target)
+    return _pipeline
+
+
+if __name__ == '__main__':
+    hl.main()
@@ -85,6 +85,21 @@ class Point:
         return Point(-self.x, -self.y)
 
 
+'''
+Whether the pipeline is being scheduled by a Halide autoscheduler, in which case
+no manual scheduling directives may be applied.
+Outside a Generator, e.g. when a stage is built on its own, the manual schedules are used.
+
+Returns: bool
+'''
+def use_autoscheduler():
+    try:
+        context = hl.active_generator_context()
+    except hl.HalideError:
+        return False
+    return bool(context.autoscheduler_params().name)
+
+
 def gaussian_down4(input, name):
     output = hl.Func(name)
     k = hl.Func(name + "_filter")
@@ -122,10 +137,11 @@ def gaussian_down4(input, name):
                               hl.sum(hl.cast(hl.UInt(32), input[4 * x + rdom.x, 4 * y + rdom.y, n] * k[rdom.x, rdom.y]))
                               / 159)
 
-    k.compute_root().parallel(y).parallel(x)
-    for i in range(k.num_update_definitions()):
-        k.update(i).unscheduled() 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        k.compute_root().parallel(y).parallel(x)
+        for i in range(k.num_update_definitions()):
+            k.update(i).unscheduled() 
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 
@@ -138,7 +154,8 @@ def box_down2(input, name):
 
     output[x, y, n] = hl.cast(hl.UInt(16), hl.sum(hl.cast(hl.UInt(32), input[2 * x + rdom.x, 2 * y + rdom.y, n])) / 4)
 
-    output.compute_root().parallel(y).vectorize(x, 16)
+    if not use_autoscheduler():
+        output.compute_root().parallel(y).vectorize(x, 16)
 
     return output
 